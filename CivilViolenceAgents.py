@@ -3,10 +3,37 @@ import random
 
 from mesa import Agent
 from settings import PROPAGANDA_AGENT_CLASS,POPULATION_AGENT_CLASS,COP_AGENT_CLASS
+from utils.event_log import ARREST, ACTIVATION, DEACTIVATION, EXPOSURE, CONCEALMENT
 
 FACTOR = 1
 
-class PopulationAgent(Agent):
+class JailableAgent(Agent):
+    '''
+    Base for agents that can be jailed by cops.
+
+    Jailed agents are kept out of the schedule until their release step (see
+    utils.schedule.JailActivation), so the remaining sentence is derived from
+    the release step instead of being counted down every step.
+
+    Attributes:
+    release_step: first step the agent is free again
+    '''
+
+    def __init__(self, unique_id, model):
+        super().__init__(unique_id, model)
+        self.release_step = 0
+
+    @property
+    def jail_time(self):
+        # Number of steps remaining in jail, 0 when free
+        return max(0, self.release_step - self.model.schedule.steps)
+
+    def release(self):
+        # Reset the agent's state when she gets out of jail
+        pass
+
+
+class PopulationAgent(JailableAgent):
     '''
     An agent from the population distribution, can become active and be jailed
     Movement Rule: Move to a random empty cell within local vision
@@ -72,7 +99,6 @@ class PopulationAgent(Agent):
         self.risk_aversion = risk_aversion
         self.threshold = threshold
         self.vision = vision
-        self.jail_time = 0
         self.arrest_probability = None
         self.pos = pos
 
@@ -118,20 +144,14 @@ class PopulationAgent(Agent):
             cell for cell in self.neighborhood if self.model.grid.is_cell_empty(cell)]
 
 
+    def release(self):
+        # If a jailed agent is released, they are inactive
+        self.active = False
+
     def step(self):
         # The population agent's movement and activenes rules A and M from the
         # paper
-        """
-            If an agent is jailed it cannot move in the grid
-            For each step, their jail time will be reduced by 1
-            If a jailed agent is released, they are inactive
-        """
-
-        if self.jail_time:
-            self.jail_time -= 1
-            if not self.jail_time:
-                self.active = False
-            return
+        # Jailed agents are out of the schedule, so they never get here
 
         self.search_neighborhood()
 
@@ -172,13 +192,16 @@ class PopulationAgent(Agent):
         # then transition back to inactive state
         if not self.active and thresh_bool:
             self.active = True
+            self.model.log_event(ACTIVATION, self)
         elif self.active and not thresh_bool:
             self.active = False
+            self.model.log_event(DEACTIVATION, self)
 
         # randomly move to an empty neighborhood cell
         if self.model.movement and self.empty_cells:
             new_pos = self.random.choice(self.empty_cells)
             self.model.grid.move_agent(self, new_pos)
+            self.model.log_move(self)
 
     '''
     This function will update grievance value due to propaganda
@@ -252,22 +275,26 @@ class CopAgent(Agent):
         elif self.model.movement and self.empty_cells:
             new_pos = self.random.choice(self.empty_cells)
             self.model.grid.move_agent(self, new_pos)
+            self.model.log_move(self)
 
     # class method for jailing a propaganda/active population agent and moving
     # to their position if applicable
     def jail_agent(self, agents):
         jailed = self.random.choice(agents)
-        jailed.jail_time = self.random.randint(1, self.model.max_jail_term)
+        jail_term = self.random.randint(1, self.model.max_jail_term)
+        self.model.schedule.jail(jailed, jail_term)
+        self.model.log_event(ARREST, self, target=jailed, value=jail_term)
         # reduce the influence of the propaganda agent for when they become free
         if jailed.agent_class in [PROPAGANDA_AGENT_CLASS]:
             #print('jailed propaganda agent,')
-            jailed.total_influence /= jailed.jail_time * FACTOR
+            jailed.total_influence /= jail_term * FACTOR
             #print('with new total influence after release:{:.4f}'.format(jailed.total_influence)) 
             
         if self.model.movement:
             self.model.grid.move_agent(self, jailed.pos)
+            self.model.log_move(self)
 
-class PropagandaAgent(Agent):
+class PropagandaAgent(JailableAgent):
     '''
     Agents who spread propaganada.
 
@@ -283,18 +310,15 @@ class PropagandaAgent(Agent):
         self.total_influence = 0
         self.exposure_threshold = exposure_threshold
         self.visible_to_cops = False 
-        self.jail_time = 0 
         self.vision = vision
         self.pos = pos
 
-    def step(self):
+    def release(self):
+        # released propaganda agents are no longer exposed to cops
+        self.visible_to_cops = False
 
-        # no action for jailed agents
-        if self.jail_time:
-            self.jail_time -= 1
-            if not self.jail_time:
-                self.visible_to_cops = False
-            return
+    def step(self):
+        # no action for jailed agents, they are out of the schedule
 
         # position of neighborhood cells
         self.neighborhood = self.model.grid.get_neighborhood(
@@ -314,15 +338,16 @@ class PropagandaAgent(Agent):
                 self.total_influence += FACTOR * self.influence * agent.susceptibility / len(quiets_in_vision)
 
         # expose propaganda agent if she has severely influenced the population
-        if self.total_influence > self.exposure_threshold:
-            self.visible_to_cops = True
-        else:
-            self.visible_to_cops = False
+        visible_to_cops = self.total_influence > self.exposure_threshold
+        if visible_to_cops != self.visible_to_cops:
+            self.model.log_event(EXPOSURE if visible_to_cops else CONCEALMENT, self)
+        self.visible_to_cops = visible_to_cops
 
         # move if applicable to an empty neighbouring cell
         if self.model.movement and self.empty_cells:
             new_pos = self.random.choice(self.empty_cells)
             self.model.grid.move_agent(self, new_pos)
+            self.model.log_move(self)
 
 
 
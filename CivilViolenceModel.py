@@ -1,10 +1,19 @@
+from time import perf_counter
+
+import numpy as np
+
 from mesa import Model
-from mesa.time import RandomActivation
 
 from mesa.space import Grid
 from mesa.datacollection import DataCollector
 
 from CivilViolenceAgents import PopulationAgent, CopAgent,PropagandaAgent
+from utils.convergence import STOP, FAST_FORWARD, SteadyStateDetector, is_absorbing
+from utils.event_log import EventLogWriter, MOVE
+from utils.metrics import ModelMetrics
+from utils.replay import KeyframeRecorder
+from utils.schedule import JailActivation
+from utils.sparse_grid import SparseGrid
 
 from settings import POPULATION_AGENT_CLASS,PROPAGANDA_AGENT_CLASS,COP_AGENT_CLASS
 
@@ -38,6 +47,39 @@ class CivilViolenceModel(Model):
 
         propaganda_allowed: True if we are allowing propaganda
 
+        on_convergence: what to do once the run has settled. None never
+            checks, 'stop' ends the run, 'fast_forward' fills in the reporters
+            up to max_iters from the jail release queue (without stepping any
+            agent) once the state is absorbing, and stops on a settled
+            reporter window. Fast forwarding requires movement to be off:
+            moving agents keep changing their net risk, which can only be
+            known by stepping them.
+        convergence_window: number of steps the reporters must stay within
+            convergence_tolerance for the run to count as settled. 0 only
+            uses the exact absorbing state check.
+        convergence_tolerance: allowed spread of the reporters inside the
+            convergence window.
+
+        event_log: path of the binary log of arrests, (de)activations,
+            propaganda exposures and releases (see utils.event_log). None
+            disables event logging.
+        keyframe_interval: record the run for replay. With an event log,
+            every move is logged too and the initial state plus a snapshot
+            every keyframe_interval steps (0 for the initial state only) are
+            appended next to it (to <event_log>.keyframes), so
+            utils.replay.Replay can rebuild any step of the run. None keeps
+            the event log small: no moves, no keyframes.
+        seed: seed of the model's random number generator, to make runs
+            reproducible.
+        sparse_grid: store only the occupied cells (utils.sparse_grid) and
+            draw only those at initialization, so memory, set up and step
+            time scale with the number of agents instead of the grid area.
+            Meant for very large, low density worlds.
+        metrics: path of a file rewritten with live metrics of the run
+            (throughput, time per phase, memory, reporters) in the Prometheus
+            text format, see utils.metrics. None disables it.
+        metrics_port: port of an HTTP endpoint serving the same metrics.
+        metrics_interval: minimum number of seconds between metric updates.
 
     """
 
@@ -58,6 +100,16 @@ class CivilViolenceModel(Model):
             propaganda_agent_density=2,
             propaganda_factor=1,
             exposure_threshold=10,
+            on_convergence=None,
+            convergence_window=0,
+            convergence_tolerance=0,
+            event_log=None,
+            keyframe_interval=None,
+            seed=None,
+            sparse_grid=False,
+            metrics=None,
+            metrics_port=None,
+            metrics_interval=5,
     ):
         super().__init__()
         self.height = height
@@ -76,12 +128,36 @@ class CivilViolenceModel(Model):
 
         # initiate the model's grid and schedule
         self.iteration = 0
-        self.schedule = RandomActivation(self)
-        self.grid = Grid(height, width, torus=True)
+        self.schedule = JailActivation(self)
+        if sparse_grid:
+            self.grid = SparseGrid(width, height, torus=True)
+        else:
+            self.grid = Grid(width, height, torus=True)
 
         self.propaganda_factor = propaganda_factor / 1000
         self.exposure_threshold = exposure_threshold
 
+        # convergence detection, the step at which the run settled and why
+        if on_convergence not in [None, STOP, FAST_FORWARD]:
+            raise ValueError(
+                'on_convergence must be one of None, {!r}, {!r}'.format(STOP, FAST_FORWARD))
+        if on_convergence == FAST_FORWARD and movement:
+            raise ValueError(
+                "on_convergence={!r} requires movement=False, use {!r} instead".format(FAST_FORWARD, STOP))
+        self.on_convergence = on_convergence
+        self.steady_state = SteadyStateDetector(
+            window=convergence_window,
+            tolerance=convergence_tolerance) if convergence_window else None
+        self.converged_at = None
+        self.convergence_reason = None
+
+        self.event_log = EventLogWriter(event_log) if event_log else None
+        self.metrics = ModelMetrics(metrics, metrics_port, metrics_interval) \
+            if metrics is not None or metrics_port is not None else None
+        self.keyframes = KeyframeRecorder(event_log + '.keyframes', keyframe_interval,
+                                          self.grid.width, self.grid.height) \
+            if event_log and keyframe_interval is not None else None
+
         # initiate data collectors for agent state feedback
         model_reporters = {
             "Quiescent": lambda m: self.count_type_citizens(m, False),
@@ -106,59 +182,180 @@ class CivilViolenceModel(Model):
         self.datacollector = DataCollector(model_reporters=model_reporters,
                                            agent_reporters=agent_reporters)
 
-        unique_id = 0
         if self.cop_density + self.citizen_density + self.propaganda_agent_density > 1:
             raise ValueError(
                 'Cop density + citizen density + propaganda agent density must be less than 1')
 
         # initialize agents in the grid with respect to the given densities
+        cells = self.draw_occupied_cells() if sparse_grid else self.draw_cells()
+        for unique_id, (breed, x, y) in enumerate(cells):
+            self.create_agent(breed, unique_id, (x, y))
+
+        self.running = True
+        self.datacollector.collect(self)
+        if self.keyframes is not None:
+            self.keyframes.record(self)
+
+    def draw_cells(self):
+        """
+        Visit every cell and draw what occupies it: a propaganda agent, a cop,
+        a citizen or nothing. Yields the (breed, x, y) of the occupied cells.
+        """
         for (contents, x, y) in self.grid.coord_iter():
             if self.random.random() < self.propaganda_agent_density:
-                agent = PropagandaAgent(unique_id, self,
-                                          influence = self.random.random(),
-                                          exposure_threshold = self.exposure_threshold,
-                                          vision=self.citizen_vision,
-                                          pos=(x,y))
-                unique_id += 1
-                self.grid[y][x] = agent
-                self.schedule.add(agent)
-
+                yield PROPAGANDA_AGENT_CLASS, x, y
             elif self.random.random() < self.cop_density + self.propaganda_agent_density:
-                cop = CopAgent(
-                    unique_id,
-                    self,
-                    vision=self.cop_vision,
-                    pos=(
-                        x,
-                        y))
-                unique_id += 1
-                self.grid[y][x] = cop
-                self.schedule.add(cop)
-
+                yield COP_AGENT_CLASS, x, y
             elif (self.random.random() < self.cop_density + self.citizen_density + self.propaganda_agent_density):
-                citizen = PopulationAgent(unique_id, self,
-                                          hardship=self.random.random(),
-                                          legitimacy=self.legitimacy,
-                                          risk_aversion=self.random.random(),
-                                          threshold=self.active_threshold,
-                                          susceptibility=self.random.random(),
-                                          propaganda_factor=self.propaganda_factor,
-                                          vision=self.citizen_vision,
-                                          pos=(x, y))
-                unique_id += 1
-                self.grid[y][x] = citizen
-                self.schedule.add(citizen)
+                yield POPULATION_AGENT_CLASS, x, y
 
-        self.running = True
-        self.datacollector.collect(self)
+    def draw_occupied_cells(self):
+        """
+        Same distribution as draw_cells, but only the occupied cells are
+        drawn, so the cost scales with the number of agents instead of the
+        grid area: the number of agents is binomial, their cells are sampled
+        without replacement and each one gets a breed with the probabilities
+        of draw_cells given that the cell is occupied. The draws differ from
+        draw_cells, so a seed gives a different world than on a dense grid.
+        """
+        propaganda = self.propaganda_agent_density
+        cop = (1 - propaganda) * min(self.cop_density + propaganda, 1)
+        citizen = (1 - propaganda) * (1 - min(self.cop_density + propaganda, 1)) * \
+            min(self.cop_density + self.citizen_density + propaganda, 1)
+        occupied = propaganda + cop + citizen
+        area = self.grid.width * self.grid.height
+        count = np.random.RandomState(self.random.getrandbits(32)).binomial(area, occupied)
+        # in the order of draw_cells, so unique ids are given the same way
+        for cell in sorted(self.random.sample(range(area), count)):
+            u = self.random.random() * occupied
+            if u < propaganda:
+                breed = PROPAGANDA_AGENT_CLASS
+            elif u < propaganda + cop:
+                breed = COP_AGENT_CLASS
+            else:
+                breed = POPULATION_AGENT_CLASS
+            x, y = divmod(cell, self.grid.height)
+            yield breed, x, y
+
+    def create_agent(self, breed, unique_id, pos):
+        """ Create an agent of the given breed, then place and schedule it. """
+        if breed == PROPAGANDA_AGENT_CLASS:
+            agent = PropagandaAgent(unique_id, self,
+                                    influence = self.random.random(),
+                                    exposure_threshold = self.exposure_threshold,
+                                    vision=self.citizen_vision,
+                                    pos=pos)
+        elif breed == COP_AGENT_CLASS:
+            agent = CopAgent(
+                unique_id,
+                self,
+                vision=self.cop_vision,
+                pos=pos)
+        else:
+            agent = PopulationAgent(unique_id, self,
+                                    hardship=self.random.random(),
+                                    legitimacy=self.legitimacy,
+                                    risk_aversion=self.random.random(),
+                                    threshold=self.active_threshold,
+                                    susceptibility=self.random.random(),
+                                    propaganda_factor=self.propaganda_factor,
+                                    vision=self.citizen_vision,
+                                    pos=pos)
+        self.grid.place_agent(agent, pos)
+        self.schedule.add(agent)
 
     def step(self):
         # Advance the model by one step and collect data.
+        started = perf_counter()
+        agents_stepped = self.schedule.get_agent_count()
         self.schedule.step()
+        scheduled = perf_counter()
         self.datacollector.collect(self)
+        collected = perf_counter()
         self.iteration += 1
         if self.iteration > self.max_iters:
             self.running = False
+        elif self.on_convergence:
+            self.check_convergence()
+        checked = perf_counter()
+        if self.keyframes is not None:
+            self.keyframes.record(self)
+        if self.metrics is not None:
+            self.metrics.observe_step(self, agents_stepped, {
+                'schedule': scheduled - started,
+                'collect': collected - scheduled,
+                'convergence': checked - collected,
+                'keyframes': perf_counter() - checked,
+            })
+        if not self.running:
+            self.close()
+
+    def close(self):
+        """
+        Flush and close the event log, keyframes and metrics, if enabled.
+        Called when the run stops, call it yourself when interrupting a run.
+        """
+        if self.event_log is not None:
+            self.event_log.close()
+        if self.keyframes is not None:
+            self.keyframes.close()
+        if self.metrics is not None:
+            self.metrics.close()
+
+    def log_move(self, agent):
+        """
+        Log a move of the agent, only when the run is recorded for replay.
+        """
+        if self.keyframes is not None:
+            self.event_log.record(self.schedule.steps, MOVE, agent)
+
+    def log_event(self, kind, agent, target=None, value=0):
+        """
+        Append an event of the current step to the event log, if enabled.
+        """
+        if self.event_log is not None:
+            self.event_log.record(self.schedule.steps, kind, agent, target, value)
+
+    def check_convergence(self):
+        """
+        Check whether the run has settled and act as set by on_convergence.
+        The absorbing state is exact, so it can be fast forwarded, while a
+        settled reporter window is only a heuristic and always stops the run.
+        """
+        if is_absorbing(self):
+            self.converged_at = self.iteration
+            self.convergence_reason = 'absorbing'
+            if self.on_convergence == FAST_FORWARD:
+                self.fast_forward()
+            self.running = False
+        elif self.steady_state is not None and self.steady_state(self):
+            self.converged_at = self.iteration
+            self.convergence_reason = 'steady'
+            self.running = False
+
+    def fast_forward(self):
+        """
+        Run an absorbing run up to max_iters without stepping any agent.
+        Nobody can go active or get arrested anymore, so the reporters only
+        change when agents get out of jail: the release queue is advanced step
+        by step, the reporters are recomputed on the steps with releases and
+        the previous row is repeated on all the others. This is exact only
+        because agents do not move (see on_convergence), so the neighborhoods
+        and net risks stay as they are. Agent reporters are not collected for
+        the fast forwarded steps.
+        """
+        model_reporters = self.datacollector.model_reporters
+        model_vars = self.datacollector.model_vars
+        while self.iteration <= self.max_iters:
+            if self.schedule.advance():
+                for var, reporter in model_reporters.items():
+                    model_vars[var].append(reporter(self))
+            else:
+                for var in model_reporters:
+                    model_vars[var].append(model_vars[var][-1])
+            self.iteration += 1
+            if self.keyframes is not None:
+                self.keyframes.record(self)
 
     @staticmethod
     def count_type_citizens(model, count_actives, exclude_jailed=True):
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from CivilViolenceModel import CivilViolenceModel
+from utils.metrics import CampaignMetrics, ModelMetrics, peak_memory_usage
+from utils.sensitivity import (scale, saltelli_design, sobol_indices,
+                               morris_design, morris_indices)
+
+# parameters under study: (low, high, integer), on the same scales as the
+# model arguments. Cop and propaganda densities are kept low enough to fit
+# next to the default 70% citizen density.
+PROBLEM = {
+    "legitimacy": (0, 100, False),
+    "propaganda_factor": (0, 1000, False),
+    "exposure_threshold": (0, 100, False),
+    "cop_density": (0, 15, False),
+    "propaganda_agent_density": (0, 15, False),
+    "citizen_vision": (1, 10, True),
+    "cop_vision": (1, 10, True),
+}
+
+# fixed arguments of every run. A run stops once Active and Jailed have
+# stayed within 30 agents for 50 steps: quenched regimes only churn a few
+# arrests and releases around a level, while outbursts swing by hundreds.
+# The final levels are therefore those at convergence, or at max_iters for
+# runs that never settle.
+MODEL_KWARGS = {
+    "max_iters": 250,
+    "on_convergence": "stop",
+    "convergence_window": 50,
+    "convergence_tolerance": 30,
+}
+
+# the final levels are the last collected values, see MODEL_KWARGS
+OUTPUTS = ["Outbursts", "Mean Outburst Peak", "Final Active", "Final Jailed"]
+
+
+def outburst_statistics(actives, threshold):
+    """
+    Count the outbursts in a series of Active values, an outburst being a
+    maximal run of steps with more than `threshold` actives, and return
+    their number and mean peak.
+    """
+    peaks, peak = [], None
+    for value in actives:
+        if value > threshold:
+            peak = value if peak is None else max(peak, value)
+        elif peak is not None:
+            peaks.append(peak)
+            peak = None
+    if peak is not None:
+        peaks.append(peak)
+    return len(peaks), float(np.mean(peaks)) if peaks else 0.
+
+
+def run_point(task):
+    """
+    Run the model at one design point and return its outputs, along with
+    the throughput statistics of the run for the campaign metrics.
+    """
+    index, params, model_kwargs, outburst_threshold = task
+    kwargs = dict(model_kwargs)
+    kwargs.update(params)
+    model = CivilViolenceModel(seed=index, **kwargs)
+    # only counts steps and phase times, nothing is published by the workers
+    model.metrics = ModelMetrics(interval=float("inf"))
+    model.run_model()
+    model_vars = model.datacollector.model_vars
+    outbursts, mean_peak = outburst_statistics(model_vars["Active"], outburst_threshold)
+    stats = {
+        "steps": model.metrics.steps,
+        "agents_stepped": model.metrics.agents_stepped,
+        "phase_seconds": model.metrics.phase_seconds,
+        "worker": os.getpid(),
+        "peak_memory_bytes": peak_memory_usage(),
+    }
+    return index, {
+        "Outbursts": outbursts,
+        "Mean Outburst Peak": mean_peak,
+        "Final Active": model_vars["Active"][-1],
+        "Final Jailed": model_vars["Jailed"][-1],
+    }, stats
+
+
+def make_design(method, n, problem, seed=None):
+    """ Return the unit design of the given method for the problem. """
+    dims = len(problem)
+    if method == "sobol":
+        return saltelli_design(n, dims, seed=seed)
+    elif method == "morris":
+        return morris_design(n, dims, seed=seed)
+    raise ValueError("Unknown sensitivity method {!r}, use 'sobol' or 'morris'".format(method))
+
+
+def load_checkpoint(path, header):
+    """
+    Return the outputs already stored in a checkpoint, keyed by design row.
+    The checkpoint starts with a header describing the campaign, a different
+    campaign is refused instead of silently mixing results.
+    """
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if lines and json.loads(lines[0]) != header:
+        raise ValueError("Checkpoint {} belongs to a different campaign".format(path))
+    for line in lines[1:]:
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # last line of an interrupted write
+            continue
+        results[record["index"]] = record["outputs"]
+    return results
+
+
+def run_campaign(method="sobol", n=64, checkpoint="sensitivity_checkpoint.jsonl",
+                 processes=None, problem=PROBLEM, model_kwargs=MODEL_KWARGS,
+                 outburst_threshold=50, bootstrap=100, confidence=0.95, seed=0,
+                 metrics=None, metrics_port=None, metrics_interval=5):
+    """
+    Run a sensitivity analysis campaign and return the indices of every
+    output as a DataFrame indexed by (output, parameter).
+
+    The model is run at every point of a Saltelli (method='sobol', n base
+    points) or Morris (method='morris', n trajectories) design, in parallel
+    over `processes` workers. Every finished run is appended to the
+    checkpoint file, so running the same campaign again only runs the
+    missing points. Progress can be watched live through a metrics file
+    and/or HTTP port (see utils.metrics).
+    """
+    names = list(problem)
+    bounds = [problem[name] for name in names]
+    unit = make_design(method, n, problem, seed=seed)
+    values = scale(unit, bounds)
+
+    # the design version keeps checkpoints of the unscrambled Halton design
+    # from being resumed with the current one
+    header = {"method": method, "design": 2, "n": n, "seed": seed,
+              "problem": {name: list(problem[name]) for name in names},
+              "model_kwargs": model_kwargs, "outburst_threshold": outburst_threshold}
+    results = load_checkpoint(checkpoint, header)
+
+    tasks = []
+    for index, row in enumerate(values):
+        if index in results:
+            continue
+        params = {name: (int(value) if problem[name][2] else float(value))
+                  for name, value in zip(names, row)}
+        tasks.append((index, params, model_kwargs, outburst_threshold))
+
+    new_checkpoint = not os.path.exists(checkpoint) or not os.path.getsize(checkpoint)
+    with open(checkpoint, "a") as f:
+        if new_checkpoint:
+            f.write(json.dumps(header) + "\n")
+        else:
+            # terminate the last line of an interrupted write
+            f.write("\n")
+        f.flush()
+        if processes == 1:
+            runs = map(run_point, tasks)
+            pool = None
+        else:
+            pool = Pool(processes)
+            runs = pool.imap_unordered(run_point, tasks)
+        # started after the pool, so workers are not forked with the HTTP
+        # server thread running and its socket open
+        progress = CampaignMetrics(len(values), len(results), metrics, metrics_port, metrics_interval) \
+            if metrics is not None or metrics_port is not None else None
+        try:
+            for index, outputs, stats in runs:
+                results[index] = outputs
+                f.write(json.dumps({"index": index, "outputs": outputs}) + "\n")
+                f.flush()
+                if progress is not None:
+                    progress.observe_run(len(results), stats, outputs)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if progress is not None:
+                progress.close()
+
+    indices = []
+    for output in OUTPUTS:
+        y = np.array([results[index][output] for index in range(len(values))])
+        if method == "sobol":
+            stats = sobol_indices(y, n, len(names), bootstrap, confidence, seed)
+        else:
+            stats = morris_indices(unit, y, bootstrap, confidence, seed)
+        frame = pd.DataFrame(stats, index=names)
+        frame.index.name = "parameter"
+        indices.append(pd.concat({output: frame}, names=["output"]))
+    return pd.concat(indices)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Global sensitivity analysis of the civil violence model")
+    parser.add_argument("--method", choices=["sobol", "morris"], default="sobol")
+    parser.add_argument("-n", type=int, default=64,
+                        help="base points (sobol) or trajectories (morris)")
+    parser.add_argument("--checkpoint", default="sensitivity_checkpoint.jsonl")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-iters", type=int, default=MODEL_KWARGS["max_iters"])
+    parser.add_argument("--output", default="sensitivity_indices.csv")
+    parser.add_argument("--metrics", default=None,
+                        help="file rewritten with live progress metrics")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="port of an HTTP endpoint serving live progress metrics")
+    args = parser.parse_args()
+
+    model_kwargs = dict(MODEL_KWARGS, max_iters=args.max_iters)
+    indices = run_campaign(args.method, args.n, args.checkpoint, args.processes,
+                           model_kwargs=model_kwargs, metrics=args.metrics,
+                           metrics_port=args.metrics_port)
+    indices.to_csv(args.output)
+    print(indices)
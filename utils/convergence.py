@@ -0,0 +1,64 @@
+from settings import POPULATION_AGENT_CLASS, PROPAGANDA_AGENT_CLASS
+
+STOP = 'stop'
+FAST_FORWARD = 'fast_forward'
+
+
+def is_absorbing(model):
+    """
+    Exact check for an absorbing state of the model.
+
+    The state is absorbing when no citizen is active, no citizen (free or
+    jailed) can ever become active again and no propaganda agent can ever
+    change a grievance or be arrested. From then on the only thing left in the
+    run is agents wandering around and the jail countdowns running out.
+
+    A citizen goes active when G - NR > T. Since NR >= 0, a citizen with
+    G <= T can never go active, and G only grows through propaganda, so we
+    also require every propaganda agent to have no influence left and to be
+    unexposed.
+    """
+    for agent in model.schedule.agents:
+        if agent.agent_class == POPULATION_AGENT_CLASS:
+            if agent.active and not agent.jail_time:
+                return False
+            if agent.grievance > agent.threshold:
+                return False
+        elif agent.agent_class == PROPAGANDA_AGENT_CLASS:
+            if agent.influence > 0 or agent.visible_to_cops:
+                return False
+            if agent.total_influence > agent.exposure_threshold:
+                return False
+    return True
+
+
+class SteadyStateDetector:
+    """
+    Window based convergence detector over the model reporter series.
+
+    A run is considered settled when, for each of the given reporters, the
+    last `window` collected values stay within `tolerance` of each other.
+
+    Attributes:
+        reporters: names of the model reporters to watch
+        window: number of most recent collected values to look at
+        tolerance: maximum allowed spread (max - min) inside the window
+    """
+
+    def __init__(self, reporters=("Active", "Jailed"), window=50, tolerance=0):
+        if window < 2:
+            raise ValueError('Convergence window must be at least 2 steps')
+        self.reporters = tuple(reporters)
+        self.window = window
+        self.tolerance = tolerance
+
+    def __call__(self, model):
+        model_vars = model.datacollector.model_vars
+        for reporter in self.reporters:
+            series = model_vars[reporter]
+            if len(series) < self.window:
+                return False
+            values = series[-self.window:]
+            if max(values) - min(values) > self.tolerance:
+                return False
+        return True
@@ -0,0 +1,139 @@
+import numpy as np
+
+from settings import POPULATION_AGENT_CLASS, PROPAGANDA_AGENT_CLASS, COP_AGENT_CLASS
+
+MAGIC = b'CVEL\x02'
+
+# event kinds
+ARREST = 1
+ACTIVATION = 2
+DEACTIVATION = 3
+EXPOSURE = 4
+CONCEALMENT = 5
+RELEASE = 6
+MOVE = 7
+
+EVENT_KINDS = {
+    'arrest': ARREST,
+    'activation': ACTIVATION,
+    'deactivation': DEACTIVATION,
+    'exposure': EXPOSURE,
+    'concealment': CONCEALMENT,
+    'release': RELEASE,
+    'move': MOVE,
+}
+
+BREEDS = (POPULATION_AGENT_CLASS, PROPAGANDA_AGENT_CLASS, COP_AGENT_CLASS)
+BREED_CODES = {breed: code for code, breed in enumerate(BREEDS)}
+
+# one fixed size record per event, 26 bytes. Positions are 32 bit so
+# sparse grids wider than 65535 cells can be logged too
+EVENT_DTYPE = np.dtype([
+    ('step', '<u4'),
+    ('kind', 'u1'),
+    ('breed', 'u1'),
+    ('x', '<u4'),
+    ('y', '<u4'),
+    ('agent', '<u4'),
+    ('target', '<i4'),
+    ('value', '<i4'),
+])
+
+
+class EventLogWriter:
+    """
+    Append only binary stream of model events.
+
+    Every event is a fixed size record (see EVENT_DTYPE) made of the step it
+    happened in, its kind, the breed and position of its subject, the id of
+    the agent that caused it, the id of the agent it happened to (-1 if none)
+    and an integer value (the jail term for arrests). The subject is the
+    target if there is one, otherwise the agent itself.
+
+    Records are buffered in memory and written in blocks of buffer_size.
+    Once closed, the log covers the run up to the step it stopped at, and
+    events recorded afterwards (e.g. stepping a stopped model) are ignored.
+    """
+
+    def __init__(self, path, buffer_size=4096):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def record(self, step, kind, agent, target=None, value=0):
+        if self._file.closed:
+            return
+        subject = agent if target is None else target
+        x, y = subject.pos
+        self._buffer.append((
+            step, kind, BREED_CODES[subject.agent_class], x, y,
+            agent.unique_id, -1 if target is None else target.unique_id, value))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            np.array(self._buffer, dtype=EVENT_DTYPE).tofile(self._file)
+            self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventLogReader:
+    """
+    Columnar reader of an event log written by EventLogWriter.
+
+    The whole log is loaded as a numpy structured array, so each field can be
+    accessed as a column, e.g. reader.events('arrest')['target'].
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a civil violence event log'.format(path))
+            self._events = np.fromfile(f, dtype=EVENT_DTYPE)
+
+    def __len__(self):
+        return len(self._events)
+
+    def events(self, kinds=None, start=None, stop=None):
+        """
+        Return the events of the given kinds (names or codes) that happened
+        in steps start <= step < stop. Events are stored in step order, so
+        the step range is found with a binary search.
+        """
+        steps = self._events['step']
+        first = 0 if start is None else np.searchsorted(steps, start, side='left')
+        last = len(steps) if stop is None else np.searchsorted(steps, stop, side='left')
+        events = self._events[first:last]
+        if kinds is not None:
+            if isinstance(kinds, (str, int)):
+                kinds = [kinds]
+            codes = [EVENT_KINDS[kind] if isinstance(kind, str) else kind for kind in kinds]
+            events = events[np.isin(events['kind'], codes)]
+        return events
+
+    def column(self, name, kinds=None, start=None, stop=None):
+        """ Return a single field of the filtered events. """
+        return self.events(kinds, start, stop)[name]
+
+    def breeds(self, events):
+        """ Translate the breed codes of the given events back to agent classes. """
+        return [BREEDS[code] for code in events['breed']]
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+def memory_usage():
+    """ Return the resident memory of the process in bytes, None if unknown. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak rather than current usage, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_memory_usage():
+    """ Return the peak resident memory of the process in bytes, None if unknown. """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+class MetricsExporter:
+    """
+    Publishes metrics in the Prometheus text format.
+
+    Metrics are rendered at most once every `interval` seconds, then the
+    text is atomically rewritten to `path` and/or served over HTTP on `port`
+    (any URL of http://localhost:<port>/). Rendering is skipped in between,
+    so observing every step costs next to nothing.
+
+    Attributes:
+        path: file rewritten on every publish, None to disable
+        port: port of the HTTP endpoint, None to disable
+        interval: minimum number of seconds between two publishes
+        prefix: prefix of every metric name
+    """
+
+    def __init__(self, path=None, port=None, interval=5., prefix='civil_violence'):
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.prefix = prefix
+        self.text = ''
+        self.started = time.time()
+        self.last_publish = None
+        self._server = None
+        if port is not None:
+            self._serve(port)
+
+    def _serve(self, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.text.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('', port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+    def due(self):
+        return self.last_publish is None or time.time() - self.last_publish >= self.interval
+
+    def publish(self, metrics):
+        """
+        Render and publish a list of (name, type, help, value, labels)
+        tuples. Metrics sharing a name are grouped under a single header.
+        """
+        lines, described = [], set()
+        for name, kind, help_text, value, labels in metrics:
+            if value is None:
+                continue
+            name = '{}_{}'.format(self.prefix, name)
+            if name not in described:
+                described.add(name)
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{}{} {}'.format(name, _format_labels(labels), float(value)))
+        self.text = '\n'.join(lines) + '\n'
+        if self.path is not None:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(self.text)
+            os.replace(tmp_path, self.path)
+        self.last_publish = time.time()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class ModelMetrics(MetricsExporter):
+    """
+    Throughput and state of a running model: steps and agents stepped per
+    second (since the last publish and overall), time spent in each phase
+    of a step, memory usage and the current model reporter values.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = 0
+        self.agents_stepped = 0
+        self.phase_seconds = {}
+        self._window = (self.started, 0, 0)
+
+    def observe_step(self, model, agents_stepped, phases):
+        self.steps += 1
+        self.agents_stepped += agents_stepped
+        for phase, seconds in phases.items():
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.) + seconds
+        if self.due() or not model.running:
+            self.publish_model(model)
+
+    def publish_model(self, model):
+        now = time.time()
+        since, steps, agents_stepped = self._window
+        elapsed = max(now - since, 1e-9)
+        self._window = (now, self.steps, self.agents_stepped)
+
+        metrics = [
+            ('steps_total', 'counter', 'Steps run so far.', self.steps, None),
+            ('steps_per_second', 'gauge', 'Steps per second since the last publish.',
+             (self.steps - steps) / elapsed, None),
+            ('agents_stepped_total', 'counter', 'Agent activations so far.', self.agents_stepped, None),
+            ('agents_stepped_per_second', 'gauge', 'Agent activations per second since the last publish.',
+             (self.agents_stepped - agents_stepped) / elapsed, None),
+            ('running', 'gauge', 'Whether the model is still running.', int(model.running), None),
+            ('memory_bytes', 'gauge', 'Resident memory of the process.', memory_usage(), None),
+        ]
+        for phase, seconds in sorted(self.phase_seconds.items()):
+            metrics.append(('phase_seconds_total', 'counter', 'Time spent in each phase of a step.',
+                            seconds, {'phase': phase}))
+        for reporter, values in model.datacollector.model_vars.items():
+            if values:
+                metrics.append(('reporter', 'gauge', 'Latest value of each model reporter.',
+                                values[-1], {'name': reporter}))
+        self.publish(metrics)
+
+
+class CampaignMetrics(MetricsExporter):
+    """
+    Progress and throughput of a batch of model runs: runs done, remaining
+    and per second, steps and agents stepped per second and time per phase
+    summed over the workers, peak memory of each worker and the outputs of
+    the latest run.
+
+    Every run reports its own statistics (see observe_run), since the
+    workers doing the work are other processes than the one publishing.
+    """
+
+    def __init__(self, total, completed, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.total = total
+        self.completed = completed
+        self.runs = 0
+        self.steps = 0
+        self.agents_stepped = 0
+        self.phase_seconds = {}
+        self.worker_memory = {}
+        self.outputs = {}
+        self.publish_campaign()
+
+    def observe_run(self, completed, stats=None, outputs=None):
+        """
+        Count a finished run. stats is a dict with the steps, agents_stepped,
+        phase_seconds, worker (pid) and peak_memory_bytes of the run.
+        """
+        self.completed = completed
+        self.runs += 1
+        if stats is not None:
+            self.steps += stats['steps']
+            self.agents_stepped += stats['agents_stepped']
+            for phase, seconds in stats['phase_seconds'].items():
+                self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.) + seconds
+            self.worker_memory[stats['worker']] = stats['peak_memory_bytes']
+        if outputs is not None:
+            self.outputs = outputs
+        if self.due() or completed == self.total:
+            self.publish_campaign()
+
+    def publish_campaign(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        metrics = [
+            ('runs_total', 'gauge', 'Runs in the campaign.', self.total, None),
+            ('runs_completed', 'gauge', 'Runs completed, including resumed ones.', self.completed, None),
+            ('runs_per_second', 'gauge', 'Runs completed per second in this session.', self.runs / elapsed, None),
+            ('steps_total', 'counter', 'Steps run by the runs completed in this session.', self.steps, None),
+            ('steps_per_second', 'gauge', 'Steps per second over all workers in this session.',
+             self.steps / elapsed, None),
+            ('agents_stepped_total', 'counter', 'Agent activations of the runs completed in this session.',
+             self.agents_stepped, None),
+            ('agents_stepped_per_second', 'gauge', 'Agent activations per second over all workers in this session.',
+             self.agents_stepped / elapsed, None),
+            ('memory_bytes', 'gauge', 'Resident memory of the coordinating process.', memory_usage(), None),
+        ]
+        for phase, seconds in sorted(self.phase_seconds.items()):
+            metrics.append(('phase_seconds_total', 'counter', 'Time spent in each phase of a step, over all workers.',
+                            seconds, {'phase': phase}))
+        for worker, memory in sorted(self.worker_memory.items()):
+            metrics.append(('worker_peak_memory_bytes', 'gauge', 'Peak resident memory of each worker.',
+                            memory, {'worker': worker}))
+        for output, value in sorted(self.outputs.items()):
+            metrics.append(('output', 'gauge', 'Outputs of the latest completed run.',
+                            value, {'name': output}))
+        self.publish(metrics)
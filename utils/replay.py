@@ -0,0 +1,175 @@
+import numpy as np
+
+from settings import POPULATION_AGENT_CLASS, PROPAGANDA_AGENT_CLASS
+from utils.event_log import (ARREST, ACTIVATION, DEACTIVATION, EXPOSURE, CONCEALMENT,
+                             RELEASE, MOVE, BREED_CODES, EventLogReader)
+
+KEYFRAMES_MAGIC = b'CVKF\x01'
+
+# header of the keyframe file and of every keyframe in it
+GRID_DTYPE = np.dtype([('width', '<u4'), ('height', '<u4')])
+KEYFRAME_DTYPE = np.dtype([('step', '<u4'), ('count', '<u4')])
+
+# full state of one agent, as kept in keyframes and rebuilt by the replay
+STATE_DTYPE = np.dtype([
+    ('unique_id', '<u4'),
+    ('breed', 'u1'),
+    ('x', '<u4'),
+    ('y', '<u4'),
+    ('active', '?'),
+    ('jailed', '?'),
+    ('visible_to_cops', '?'),
+])
+
+
+def snapshot(model):
+    """
+    Return the state of every agent of the model as a structured array
+    sorted by unique_id.
+    """
+    agents = sorted(model.schedule.agents, key=lambda agent: agent.unique_id)
+    state = np.zeros(len(agents), dtype=STATE_DTYPE)
+    for i, agent in enumerate(agents):
+        state[i] = (agent.unique_id, BREED_CODES[agent.agent_class],
+                    agent.pos[0], agent.pos[1],
+                    getattr(agent, 'active', False),
+                    bool(getattr(agent, 'jail_time', 0)),
+                    getattr(agent, 'visible_to_cops', False))
+    return state
+
+
+class KeyframeRecorder:
+    """
+    Appends periodic snapshots of a model run to a binary file for the
+    replay engine.
+
+    The initial state is always recorded, then one keyframe every `interval`
+    steps (never if interval is 0). Every keyframe is written and flushed as
+    soon as it is recorded, so an interrupted run can be replayed up to its
+    last keyframe and the event log flushed so far.
+    """
+
+    def __init__(self, path, interval, width, height):
+        self.path = path
+        self.interval = interval
+        self._file = open(path, 'wb')
+        self._file.write(KEYFRAMES_MAGIC)
+        np.array((width, height), dtype=GRID_DTYPE).tofile(self._file)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def record(self, model):
+        if self._file.closed:
+            return
+        step = model.schedule.steps
+        if step == 0 or (self.interval and step % self.interval == 0):
+            state = snapshot(model)
+            np.array((step, len(state)), dtype=KEYFRAME_DTYPE).tofile(self._file)
+            state.tofile(self._file)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_keyframes(path):
+    """
+    Return the grid size and the keyframes of a file written by
+    KeyframeRecorder, as width, height and a dict of states keyed by step.
+    A keyframe cut short by an interrupted write is left out.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(KEYFRAMES_MAGIC)) != KEYFRAMES_MAGIC:
+            raise ValueError('{} is not a civil violence keyframe file'.format(path))
+        grid = np.fromfile(f, dtype=GRID_DTYPE, count=1)[0]
+        keyframes = {}
+        while True:
+            header = np.fromfile(f, dtype=KEYFRAME_DTYPE, count=1)
+            if not len(header):
+                break
+            step, count = int(header[0]['step']), int(header[0]['count'])
+            state = np.fromfile(f, dtype=STATE_DTYPE, count=count)
+            if len(state) < count:
+                break
+            keyframes[step] = state
+    return int(grid['width']), int(grid['height']), keyframes
+
+
+def _last_per_agent(ids, values):
+    """ Return the agents that appear in ids and the last value of each. """
+    reversed_ids = ids[::-1]
+    agents, index = np.unique(reversed_ids, return_index=True)
+    return agents, values[::-1][index]
+
+
+class Replay:
+    """
+    Rebuild the state of a recorded run at any step, without re-evaluating
+    the agent rules.
+
+    The nearest keyframe at or before the requested step is taken and the
+    logged events since then (moves, arrests, (de)activations, exposures and
+    releases, i.e. the outcome of every random decision that changes the
+    grid) are applied on top of it. Since only the last event of each agent
+    matters, this is done with vectorized numpy operations.
+
+    The run must have been recorded with a keyframe_interval, which is what
+    adds the moves to the event log and writes the keyframes. Continuous
+    attributes (grievance, influence, net risk) are not part of the replayed
+    state.
+    """
+
+    def __init__(self, event_log, keyframes):
+        self.events = EventLogReader(event_log)
+        self.width, self.height, self.keyframes = read_keyframes(keyframes)
+        self.keyframe_steps = np.array(sorted(self.keyframes))
+
+    def state_at(self, step):
+        """ Return the state of every agent once `step` steps have been run. """
+        position = np.searchsorted(self.keyframe_steps, step, side='right') - 1
+        if position < 0:
+            raise ValueError('No keyframe at or before step {}'.format(step))
+        start = int(self.keyframe_steps[position])
+        state = self.keyframes[start].copy()
+        events = self.events.events(start=start, stop=step)
+        kinds = events['kind']
+        ids = state['unique_id']
+
+        def apply(column, mask, agent_ids, values):
+            agents, last = _last_per_agent(agent_ids[mask], values[mask])
+            state[column][np.searchsorted(ids, agents)] = last
+
+        agent_ids = events['agent'].astype(np.int64)
+        target_ids = events['target'].astype(np.int64)
+        subject_ids = np.where(target_ids >= 0, target_ids, agent_ids)
+
+        moves = kinds == MOVE
+        apply('x', moves, agent_ids, events['x'])
+        apply('y', moves, agent_ids, events['y'])
+
+        population_release = (kinds == RELEASE) & (events['breed'] == BREED_CODES[POPULATION_AGENT_CLASS])
+        activity = (kinds == ACTIVATION) | (kinds == DEACTIVATION) | population_release
+        apply('active', activity, agent_ids, kinds == ACTIVATION)
+
+        jail = (kinds == ARREST) | (kinds == RELEASE)
+        apply('jailed', jail, subject_ids, kinds == ARREST)
+
+        propaganda_release = (kinds == RELEASE) & (events['breed'] == BREED_CODES[PROPAGANDA_AGENT_CLASS])
+        exposure = (kinds == EXPOSURE) | (kinds == CONCEALMENT) | propaganda_release
+        apply('visible_to_cops', exposure, agent_ids, kinds == EXPOSURE)
+        return state
+
+    def grid_at(self, step):
+        """
+        Return a width x height array with the unique_id of the agent in each
+        cell once `step` steps have been run, -1 for empty cells. Jailed
+        agents are only shown where no free agent has taken their cell.
+        """
+        state = self.state_at(step)
+        grid = np.full((self.width, self.height), -1, dtype=np.int64)
+        for jailed in [True, False]:
+            agents = state[state['jailed'] == jailed]
+            grid[agents['x'], agents['y']] = agents['unique_id']
+        return grid
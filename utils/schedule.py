@@ -0,0 +1,69 @@
+import heapq
+
+from mesa.time import RandomActivation
+
+from utils.event_log import RELEASE
+
+
+class JailActivation(RandomActivation):
+    """
+    Random activation that keeps jailed agents out of the schedule.
+
+    Jailed agents have nothing to do but wait, so instead of activating them
+    every step just to count their sentence down, they are parked in a release
+    queue (a heap keyed by release step) and put back in the schedule, with
+    their state reset, at the end of the step their sentence runs out.
+    Per step cost therefore scales with the free agents only.
+
+    The release step reproduces the old per-step countdown: an agent that has
+    already been activated in the step it got arrested would only have
+    started counting down on the next step.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self._jail = []
+        self._stepped = set()
+
+    def jail(self, agent, term):
+        """ Take an agent out of the schedule for term steps. """
+        release_step = self.steps + term
+        if agent.unique_id in self._stepped:
+            release_step += 1
+        agent.release_step = release_step
+        if agent.unique_id in self._agents:
+            self.remove(agent)
+        heapq.heappush(self._jail, (release_step, agent.unique_id, agent))
+
+    def step(self):
+        """ Activate the free agents in random order and release the due. """
+        for agent in self.agent_buffer(shuffled=True):
+            self._stepped.add(agent.unique_id)
+            agent.step()
+        self._stepped.clear()
+        self.advance()
+
+    def advance(self):
+        """
+        End the current step, releasing every agent due on the next one.
+        Returns the number of released agents.
+        """
+        released = 0
+        while self._jail and self._jail[0][0] <= self.steps + 1:
+            _, _, agent = heapq.heappop(self._jail)
+            agent.release()
+            self.add(agent)
+            self.model.log_event(RELEASE, agent)
+            released += 1
+        self.steps += 1
+        self.time += 1
+        return released
+
+    @property
+    def jailed(self):
+        return [agent for _, _, agent in self._jail]
+
+    @property
+    def agents(self):
+        # jailed agents still belong to the model, only they are not activated
+        return list(self._agents.values()) + self.jailed
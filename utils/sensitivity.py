@@ -0,0 +1,169 @@
+import numpy as np
+
+
+def _primes(count):
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % prime for prime in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton(n, dims, skip=1, seed=None):
+    """
+    Return the first n points of the dims dimensional Halton sequence in
+    [0, 1)^dims, skipping the first `skip` points (the first one is the
+    origin).
+
+    With a seed the sequence is randomized: the digits of every dimension go
+    through random permutations (one per digit position) and the points get a
+    random Cranley-Patterson shift (modulo 1). Plain Halton points of large
+    prime bases only increase slowly with the index, so their dimensions are
+    strongly correlated for short sequences, the scrambling breaks this.
+    """
+    rng = np.random.RandomState(seed) if seed is not None else None
+    indices = np.arange(skip, skip + n)
+    points = np.zeros((n, dims))
+    for dim, base in enumerate(_primes(dims)):
+        # enough digits for the largest index, plus one so the scrambled
+        # leading zeros are randomized too
+        digits = int(np.ceil(np.log(skip + n + 1) / np.log(base))) + 1
+        i = indices.copy()
+        f = 1. / base
+        for _ in range(digits):
+            digit = i % base
+            if rng is not None:
+                digit = rng.permutation(base)[digit]
+            points[:, dim] += f * digit
+            i //= base
+            f /= base
+    if rng is not None:
+        points = (points + rng.uniform(size=dims)) % 1.
+    return points
+
+
+def scale(unit, bounds):
+    """
+    Map points of the unit hypercube to parameter values. bounds is a list
+    of (low, high, integer) tuples. Integer parameters split [0, 1) into
+    high - low + 1 equal bins, so every value, the bounds included, is
+    equally likely.
+    """
+    values = np.empty_like(unit, dtype=float)
+    for dim, (low, high, integer) in enumerate(bounds):
+        if integer:
+            values[:, dim] = np.minimum(np.floor(low + unit[:, dim] * (high - low + 1)), high)
+        else:
+            values[:, dim] = low + unit[:, dim] * (high - low)
+    return values
+
+
+def saltelli_design(n, dims, seed=None, skip=64):
+    """
+    Quasi-random design for Sobol indices. Two n x dims matrices A and B are
+    taken from a 2*dims randomized Halton sequence (seeded by seed, leaving
+    out its first `skip` points), then for every dimension i the matrix AB_i
+    is A with column i taken from B. The design is the stack
+    [A, B, AB_1, ..., AB_dims] of n * (dims + 2) unit points.
+
+    The Sobol estimators assume independent inputs, so the columns of A and
+    B must not be correlated, hence the scrambling (see halton).
+    """
+    base = halton(n, 2 * dims, skip=skip, seed=0 if seed is None else seed)
+    A, B = base[:, :dims], base[:, dims:]
+    blocks = [A, B]
+    for dim in range(dims):
+        AB = A.copy()
+        AB[:, dim] = B[:, dim]
+        blocks.append(AB)
+    return np.vstack(blocks)
+
+
+def sobol_indices(y, n, dims, bootstrap=100, confidence=0.95, seed=None):
+    """
+    First order (Saltelli 2010) and total (Jansen) Sobol indices of the
+    outputs y of a saltelli_design, with bootstrap confidence intervals.
+
+    Returns a dict of arrays: S1, ST and their *_low/*_high bounds.
+    """
+    y = np.asarray(y, dtype=float)
+    fA, fB = y[:n], y[n:2 * n]
+    fAB = y[2 * n:].reshape(dims, n)
+
+    def estimate(rows):
+        a, b, ab = fA[rows], fB[rows], fAB[:, rows]
+        variance = np.var(np.concatenate([a, b]))
+        if variance == 0:
+            return np.zeros(dims), np.zeros(dims)
+        s1 = np.mean(b * (ab - a), axis=1) / variance
+        st = 0.5 * np.mean((a - ab) ** 2, axis=1) / variance
+        return s1, st
+
+    s1, st = estimate(np.arange(n))
+    rng = np.random.RandomState(seed)
+    samples = [estimate(rng.randint(n, size=n)) for _ in range(bootstrap)]
+    s1_samples = np.array([sample[0] for sample in samples])
+    st_samples = np.array([sample[1] for sample in samples])
+    tail = 100 * (1 - confidence) / 2
+    return {
+        'S1': s1,
+        'S1_low': np.percentile(s1_samples, tail, axis=0),
+        'S1_high': np.percentile(s1_samples, 100 - tail, axis=0),
+        'ST': st,
+        'ST_low': np.percentile(st_samples, tail, axis=0),
+        'ST_high': np.percentile(st_samples, 100 - tail, axis=0),
+    }
+
+
+def morris_design(trajectories, dims, levels=4, seed=None):
+    """
+    Morris one-at-a-time design on a grid of `levels` levels. Every
+    trajectory starts at a random grid point and then moves each dimension
+    once, in random order, by delta = levels / (2 * (levels - 1)). The design
+    is the stack of trajectories * (dims + 1) unit points.
+    """
+    rng = np.random.RandomState(seed)
+    delta = levels / (2. * (levels - 1))
+    grid = np.arange(levels) / (levels - 1.)
+    points = []
+    for _ in range(trajectories):
+        x = rng.choice(grid, size=dims)
+        points.append(x.copy())
+        for dim in rng.permutation(dims):
+            x[dim] += delta if x[dim] + delta <= 1 else -delta
+            points.append(x.copy())
+    return np.array(points)
+
+
+def morris_indices(design, y, bootstrap=100, confidence=0.95, seed=None):
+    """
+    Morris elementary effects statistics of the outputs y of a morris_design:
+    mu, mu_star (mean absolute effect) and sigma for each dimension, with a
+    bootstrap confidence interval for mu_star over trajectories.
+
+    Returns a dict of arrays: mu, mu_star, mu_star_low, mu_star_high, sigma.
+    """
+    y = np.asarray(y, dtype=float)
+    dims = design.shape[1]
+    trajectories = len(design) // (dims + 1)
+    effects = np.zeros((trajectories, dims))
+    for t in range(trajectories):
+        rows = slice(t * (dims + 1), (t + 1) * (dims + 1))
+        steps = np.diff(design[rows], axis=0)
+        changes = np.diff(y[rows])
+        dim = np.argmax(np.abs(steps), axis=1)
+        effects[t, dim] = changes / steps[np.arange(dims), dim]
+
+    rng = np.random.RandomState(seed)
+    samples = np.array([np.mean(np.abs(effects[rng.randint(trajectories, size=trajectories)]), axis=0)
+                        for _ in range(bootstrap)])
+    tail = 100 * (1 - confidence) / 2
+    return {
+        'mu': effects.mean(axis=0),
+        'mu_star': np.abs(effects).mean(axis=0),
+        'mu_star_low': np.percentile(samples, tail, axis=0),
+        'mu_star_high': np.percentile(samples, 100 - tail, axis=0),
+        'sigma': effects.std(axis=0, ddof=1) if trajectories > 1 else np.zeros(dims),
+    }
@@ -0,0 +1,122 @@
+class SparseGrid:
+    """
+    Single agent per cell grid that only stores the occupied cells.
+
+    A drop-in replacement of mesa.space.Grid for low density worlds: agents
+    are kept in a dict keyed by position, so memory and step time scale with
+    the number of agents instead of the grid area. The methods used by the
+    agents (get_neighborhood, get_cell_list_contents, is_cell_empty,
+    move_agent) return the same cells, in the same order, as mesa's Grid, so
+    the agent rules behave exactly the same on both backends. The model
+    draws the initial agents of a sparse grid differently (see
+    CivilViolenceModel.draw_occupied_cells), so a given seed starts from a
+    different world on each backend.
+
+    Attributes:
+        width, height: grid dimensions
+        torus: whether the grid wraps around
+    """
+
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self._cells = {}
+        # neighborhood offsets, by (moore, include_center, radius)
+        self._stencils = {}
+
+    def coord_iter(self):
+        """
+        An iterator that returns (contents, x, y) for every cell. This visits
+        the whole grid area, prefer iterating over the agents.
+        """
+        for x in range(self.width):
+            for y in range(self.height):
+                yield self._cells.get((x, y)), x, y
+
+    def _stencil(self, moore, include_center, radius):
+        key = (moore, include_center, radius)
+        if key not in self._stencils:
+            self._stencils[key] = [
+                (dx, dy)
+                for dy in range(-radius, radius + 1)
+                for dx in range(-radius, radius + 1)
+                if (dx or dy or include_center) and (moore or abs(dx) + abs(dy) <= radius)]
+        return self._stencils[key]
+
+    def iter_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """ Iterate over the coordinates of the cells around pos. """
+        x, y = pos
+        seen = set()
+        for dx, dy in self._stencil(moore, include_center, radius):
+            px, py = x + dx, y + dy
+            if self.torus:
+                px, py = px % self.width, py % self.height
+            elif not (0 <= px < self.width and 0 <= py < self.height):
+                continue
+            if (px, py) not in seen:
+                seen.add((px, py))
+                yield px, py
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """ Return the list of coordinates of the cells around pos. """
+        return list(self.iter_neighborhood(pos, moore, include_center, radius))
+
+    def iter_neighbors(self, pos, moore, include_center=False, radius=1):
+        cells = self._cells
+        for cell in self.iter_neighborhood(pos, moore, include_center, radius):
+            if cell in cells:
+                yield cells[cell]
+
+    def get_neighbors(self, pos, moore, include_center=False, radius=1):
+        """ Return the agents in the cells around pos. """
+        return list(self.iter_neighbors(pos, moore, include_center, radius))
+
+    def torus_adj(self, pos):
+        """ Convert coordinate, handling torus looping. """
+        if not self.out_of_bounds(pos):
+            return pos
+        elif not self.torus:
+            raise Exception("Point out of bounds, and space non-toroidal.")
+        return pos[0] % self.width, pos[1] % self.height
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def iter_cell_list_contents(self, cell_list):
+        if isinstance(cell_list, tuple) and len(cell_list) == 2 and isinstance(cell_list[0], int):
+            cell_list = [cell_list]
+        cells = self._cells
+        return (cells[cell] for cell in cell_list if cell in cells)
+
+    def get_cell_list_contents(self, cell_list):
+        """ Return the agents in the given cells (a list or a single cell). """
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def is_cell_empty(self, pos):
+        return pos not in self._cells
+
+    def place_agent(self, agent, pos):
+        """ Position an agent on the grid, and set its pos variable. """
+        self._cells[pos] = agent
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        """ Remove the agent from the grid and set its pos variable to None. """
+        self._remove_agent(agent.pos, agent)
+        agent.pos = None
+
+    def _remove_agent(self, pos, agent):
+        # like mesa's Grid, clear the cell whoever is in it now
+        self._cells.pop(pos, None)
+
+    def move_agent(self, agent, pos):
+        """ Move an agent from its current position to a new position. """
+        pos = self.torus_adj(pos)
+        self._remove_agent(agent.pos, agent)
+        self._cells[pos] = agent
+        agent.pos = pos
+
+    def exists_empty_cells(self):
+        return len(self._cells) < self.width * self.height